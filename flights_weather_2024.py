@@ -3,7 +3,9 @@
 merge_by_origin_date.py
 
 Lê flight_data_2024.csv (sep=';'), normaliza fl_date -> YYYY-MM-DD,
-lê todos os arquivos selected_weather/weather_<IATA>.csv (com 'time' YYYY-MM-DD),
+lê todos os arquivos selected_weather/weather_<IATA>.csv (com 'time' YYYY-MM-DD)
+(ou o .parquet gravado por resume_weather_for_missing.py)
+ou, se existir, o dataset Parquet weather/ gerado por weather_to_parquet.py,
 padroniza ambos como strings 'YYYY-MM-DD' e faz merge por (origin,iata) e (flight_date,time).
 
 Saídas:
@@ -13,27 +15,43 @@ Saídas:
  - flight_counts_by_origin.csv      (n voos por origem)
 """
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 # CONFIG
 FLIGHTS_CSV = Path("./flight_data_2024.csv")
 WEATHER_DIR = Path("./selected_weather")
+WEATHER_PARQUET_DIR = Path("./weather")  # gerado por weather_to_parquet.py
+WEATHER_INDEXED = Path("./weather_indexed.parquet")  # idem: pronto para o join
 SELECTED = [
     "BOS","ALB","JFK","PHL","ATL","MIA","ORD","MSP","IAH","MSY",
     "DEN","SLC","PHX","LAS","LAX","SFO","SEA","ANC","HNL","SJU"
 ]
+# IATA as a categorical over SELECTED: small int codes for filtering, joining and counting
+IATA_DTYPE = pd.CategoricalDtype(categories=SELECTED)
 OUT_MERGED = Path("./flights_with_origin_weather.csv")
 OUT_MISSING_ORIG = Path("./missing_weather_origins.csv")
 OUT_MISSING_MATCHES = Path("./missing_matches.csv")
 OUT_COUNTS = Path("./flight_counts_by_origin.csv")
+CSV_CHUNKSIZE = 200_000  # linhas por bloco ao gravar os CSVs grandes (memória limitada)
 
 # ---------- FUNCTIONS ----------
 def read_flights(path: Path):
-    # seu CSV usa ';' como separador, e fl_date está em DD/MM/YYYY no exemplo
-    df = pd.read_csv(path, sep=";", engine="python", dtype=str)
-    df.columns = [c.strip().replace("\ufeff","") for c in df.columns]
-    return df
+    # seu CSV usa ';' como separador, e fl_date está em MM/DD/YYYY
+    # colunas textuais ficam como string; o resto é inferido pelo parser em C/Arrow
+    dtypes = {"origin": "string[pyarrow]", "fl_date": "string[pyarrow]", "dep_time": "string[pyarrow]"}
+    try:
+        df = pd.read_csv(path, sep=";", engine="pyarrow", dtype=dtypes, dtype_backend="pyarrow")
+    except Exception:
+        # fallback se o parser do pyarrow rejeitar o arquivo (nunca engine="python")
+        df = pd.read_csv(path, sep=";", engine="c", low_memory=False, dtype=dtypes, dtype_backend="pyarrow")
+    return df.rename(columns=lambda c: c.strip().lstrip("\ufeff"))
 
 def normalize_flight_dates_and_origin(df: pd.DataFrame):
     # ensure fl_date present (header may be 'fl_date')
@@ -42,10 +60,11 @@ def normalize_flight_dates_and_origin(df: pd.DataFrame):
     # unify to 'flight_date' column
     if "flight_date" not in df.columns:
         df = df.rename(columns={"fl_date": "flight_date"})
-    # parse to datetime with dayfirst=True (input example 01/01/2024)
-    df["flight_date_parsed"] = pd.to_datetime(df["flight_date"], dayfirst=True, errors="coerce")
-    # create standardized string 'YYYY-MM-DD' for exact matching
-    df["flight_date_str"] = df["flight_date_parsed"].dt.strftime("%Y-%m-%d")
+    # input is month-first M/D/YYYY, sometimes zero-padded (01/09/2024, 1/13/2024):
+    # build the standardized 'YYYY-MM-DD' string for exact matching straight from
+    # the parts, without materializing datetimes
+    parts = df["flight_date"].str.strip().str.split("/", expand=True)
+    df["flight_date_str"] = parts[2] + "-" + parts[0].str.zfill(2) + "-" + parts[1].str.zfill(2)
     # normalize origin IATA (uppercase trimmed)
     if "origin" not in df.columns:
         raise KeyError("Coluna 'origin' não encontrada no CSV de voos.")
@@ -56,49 +75,112 @@ def normalize_flight_dates_and_origin(df: pd.DataFrame):
     # convert dep_time_raw to numeric where possible (keeps strings too)
     return df
 
+def to_iata_categorical(s: pd.Series):
+    # explicit codes: IATAs outside SELECTED get code -1 (NaN) without relying on
+    # the deprecated "unknown values become NaN" cast of Categorical/astype
+    codes = IATA_DTYPE.categories.get_indexer(s.to_numpy(dtype=object, na_value=None))
+    return pd.Categorical.from_codes(codes, dtype=IATA_DTYPE)
+
+def date_str_to_days(s: pd.Series):
+    # 'YYYY-MM-DD' -> int32 days since epoch (compact integer join key)
+    d = pd.to_datetime(s, format="%Y-%m-%d", errors="coerce")
+    return (d - pd.Timestamp("1970-01-01")).dt.days.astype("Int32")
+
+def read_weather_dataset(selected_iatas, dataset_dir: Path):
+    # Hive-partitioned parquet (weather/iata=BOS/...): only the selected partitions are read
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive")
+    table = dataset.to_table(filter=pc.field("iata").isin(selected_iatas))
+    table = table.append_column("date_str", pc.strftime(table["time"], format="%Y-%m-%d"))
+    weather_all = table.to_pandas(types_mapper=pd.ArrowDtype)
+    # same column order as the CSV path (source_file last)
+    cols = [c for c in weather_all.columns if c != "source_file"] + ["source_file"]
+    weather_all = weather_all[cols]
+    present = set(weather_all["iata"].unique())
+    found = [iata for iata in selected_iatas if iata in present]
+    return weather_all, found
+
+def weather_file_for(weather_dir: Path, iata: str):
+    # resume_weather_for_missing.py caches .parquet, older downloads are .csv
+    for suffix in (".parquet", ".csv"):
+        p = weather_dir / f"weather_{iata}{suffix}"
+        if p.exists():
+            return p
+    return None
+
+def read_weather_file(p: Path, iata: str):
+    # returns a pyarrow Table, or None if the file is missing or has no date-like column
+    if p is None or not p.exists():
+        return None
+    if p.suffix == ".parquet":
+        w = pq.read_table(p)
+    else:
+        # weather files have column 'time' like '2024-01-01' (inferred as date32)
+        w = pacsv.read_csv(p)
+    date_col = next((c for c in ("time", "date") if c in w.column_names), None)
+    if date_col is None:
+        # if no date-like column, skip this weather file (cannot join)
+        return None
+    dates = w[date_col]
+    if pa.types.is_string(dates.type):
+        # not inferred as a date: coerce invalid values to null
+        dates = pc.strptime(dates, format="%Y-%m-%d", unit="s", error_is_null=True)
+    elif pa.types.is_timestamp(dates.type):
+        # parquet cache stores pandas datetimes: same date32 type as the CSV files
+        dates = dates.cast(pa.date32())
+        w = w.set_column(w.schema.get_field_index(date_col), date_col, dates)
+    # dates are parsed once (by the CSV reader) and formatted once, here
+    w = w.append_column("date_str", pc.strftime(dates, format="%Y-%m-%d"))
+
+    # ensure iata column consistent
+    if "iata" in w.column_names:
+        col = pc.utf8_upper(pc.utf8_trim_whitespace(w["iata"].cast(pa.string())))
+        w = w.set_column(w.schema.get_field_index("iata"), "iata", col)
+    else:
+        w = w.append_column("iata", pa.array([iata] * w.num_rows, pa.string()))
+
+    # keep all columns (including weather vars); add source_iata for traceability
+    return w.append_column("source_file", pa.array([p.name] * w.num_rows, pa.string()))
+
 def read_and_stack_weather(selected_iatas, weather_dir: Path):
-    rows = []
+    if WEATHER_PARQUET_DIR.exists():
+        return read_weather_dataset(selected_iatas, WEATHER_PARQUET_DIR)
+    tables = []
     found = []
-    for iata in selected_iatas:
-        p = weather_dir / f"weather_{iata}.csv"
-        if not p.exists():
-            continue
-        try:
-            # weather files have column 'time' like '2024-01-01'
-            w = pd.read_csv(p, dtype=str, parse_dates=["time"])
-        except Exception:
-            # fallback if parse_dates fails
-            w = pd.read_csv(p, dtype=str)
-            if "time" in w.columns:
-                w["time"] = pd.to_datetime(w["time"], errors="coerce")
-        if "time" in w.columns:
-            w["date_str"] = pd.to_datetime(w["time"], errors="coerce").dt.strftime("%Y-%m-%d")
-        elif "date" in w.columns:
-            w["date_str"] = pd.to_datetime(w["date"], errors="coerce").dt.strftime("%Y-%m-%d")
-        else:
-            # if no date-like column, skip this weather file (cannot join)
-            continue
-
-        # ensure iata column consistent
-        if "iata" not in w.columns:
-            w["iata"] = iata
-        w["iata"] = w["iata"].astype(str).str.strip().str.upper()
-
-        # keep all columns (including weather vars); add source_iata for traceability
-        rows.append(w.assign(source_file=p.name))
-        found.append(iata)
-
-    if not rows:
+
+    def load_one(iata):
+        return iata, read_weather_file(weather_file_for(weather_dir, iata), iata)
+
+    # CSV parsing releases the GIL, so files are read in parallel;
+    # ex.map keeps the selected_iatas order
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(selected_iatas)))) as ex:
+        for iata, w in ex.map(load_one, selected_iatas):
+            if w is not None:
+                tables.append(w)
+                found.append(iata)
+
+    if not tables:
         # empty DataFrame with minimal cols
         return pd.DataFrame(columns=["iata","date_str"]), found
 
-    weather_all = pd.concat(rows, ignore_index=True, sort=False)
-    # keep iata and date_str columns for joining, and weather columns as-is
-    # ensure no duplicates in date_str formatting
-    weather_all["date_str"] = weather_all["date_str"].astype(str)
-    weather_all["iata"] = weather_all["iata"].astype(str).str.strip().str.upper()
+    # stack once in Arrow (reuses the column buffers, unifies e.g. all-null columns)
+    # and convert to pandas a single time
+    # (date_str is already a string column, formatted once per file in read_weather_file)
+    weather_all = pa.concat_tables(tables, promote_options="permissive").to_pandas(types_mapper=pd.ArrowDtype)
     return weather_all, found
 
+def index_weather(weather_all: pd.DataFrame):
+    # Reduce weather_all to columns we want to attach (keep all weather cols)
+    # Ensure unique rows per (iata,date_str) — if there are duplicates (unlikely for daily), keep first
+    weather_unique = weather_all.drop_duplicates(subset=["iata","date_str"], keep="first").copy()
+
+    # join keys: IATA as the categorical shared by both sides (int codes) and
+    # date as int32 days since epoch, so the hash join compares integers, not strings
+    weather_unique["iata_c"] = to_iata_categorical(weather_unique["iata"])
+    weather_unique["date_i"] = date_str_to_days(weather_unique["date_str"])
+    # rows outside SELECTED or without a valid date can never match a flight
+    weather_unique = weather_unique.dropna(subset=["iata_c","date_i"])
+    return weather_unique.set_index(["iata_c","date_i"]).sort_index()
+
 # ---------- MAIN ----------
 def main():
     print("Lendo voos:", FLIGHTS_CSV)
@@ -106,57 +188,67 @@ def main():
     print("Colunas voos:", flights.columns.tolist())
 
     flights = normalize_flight_dates_and_origin(flights)
-    # filter only origins in SELECTED
-    flights_sel = flights[flights["origin"].isin(SELECTED)].copy()
-    flights_sel["orig_iata"] = flights_sel["origin"]  # explicit column you asked
+    # derived columns are built on the full frame (cheap vector ops) so the
+    # filtered frame is never mutated and needs no defensive copy
+    flights["origin"] = to_iata_categorical(flights["origin"])
+    flights["orig_iata"] = flights["origin"]  # explicit column you asked
+    # join key: date as int32 days since epoch (see the weather side below)
+    flights["date_i"] = date_str_to_days(flights["flight_date_str"])
+    # filter only origins in SELECTED (code -1 = origin outside SELECTED)
+    flights_sel = flights.loc[flights["origin"].cat.codes.to_numpy() >= 0]
 
     print(f"Total voos (arquivo): {len(flights)} | Após filtro origens (20): {len(flights_sel)}")
+    # only the filtered frame is used from here on: release the full file early
+    del flights
 
-    # read and stack weather files for the selected iatas
-    print("Lendo weather para os 20 iatas em:", WEATHER_DIR)
-    weather_all, found = read_and_stack_weather(SELECTED, WEATHER_DIR)
+    if WEATHER_INDEXED.exists():
+        # merge-ready table (deduplicated, indexed by (iata, date), sorted) persisted
+        # by weather_to_parquet.py: no dedup/re-index needed at runtime
+        print("Lendo weather indexado:", WEATHER_INDEXED)
+        weather_unique = pd.read_parquet(WEATHER_INDEXED)
+        present = set(weather_unique["iata"].unique())
+        found = [iata for iata in SELECTED if iata in present]
+    else:
+        # read and stack weather files for the selected iatas
+        print("Lendo weather para os 20 iatas em:", WEATHER_DIR)
+        weather_all, found = read_and_stack_weather(SELECTED, WEATHER_DIR)
+        weather_unique = index_weather(weather_all)
+        del weather_all
     missing_origins = sorted(set(SELECTED) - set(found))
+    # downloads newer than weather/ (or weather_indexed.parquet) are not in it yet
+    stale = [iata for iata in missing_origins if weather_file_for(WEATHER_DIR, iata) is not None]
+    if stale and (WEATHER_INDEXED.exists() or WEATHER_PARQUET_DIR.exists()):
+        print(f"AVISO: {stale} têm arquivo em {WEATHER_DIR} mas não estão no Parquet; rode weather_to_parquet.py")
     pd.DataFrame({"iata": missing_origins}).to_csv(OUT_MISSING_ORIG, index=False)
     print(f"Weather encontrados para {len(found)} IATA; faltam {len(missing_origins)} (salvo em {OUT_MISSING_ORIG})")
 
-    if weather_all.empty:
+    if weather_unique.empty:
         print("Nenhum weather lido. Saindo.")
-        flights_sel.to_csv(OUT_MERGED, index=False)
+        flights_sel.drop(columns=["date_i"]).to_csv(OUT_MERGED, index=False, chunksize=CSV_CHUNKSIZE, lineterminator="\n")
         return
 
-    # prepare keys as strings for both dataframes
-    flights_sel["flight_date_str"] = flights_sel["flight_date_str"].astype(str)
-    weather_all["date_str"] = weather_all["date_str"].astype(str)
+    # perform left join on (origin == iata) and (flight_date_str == date_str)
+    # columns present on both sides keep the flight name; the weather one gets "_weather"
+    merged = flights_sel.join(weather_unique, on=["origin","date_i"], how="left", rsuffix="_weather")
+    merged = merged.drop(columns=["date_i"])
 
-    # Reduce weather_all to columns we want to attach (keep all weather cols)
-    # Ensure unique rows per (iata,date_str) — if there are duplicates (unlikely for daily), keep first
-    weather_unique = weather_all.drop_duplicates(subset=["iata","date_str"], keep="first").copy()
+    def weather_col(c):
+        return c + "_weather" if c in flights_sel.columns else c
 
-    # perform left merge on (origin == iata) and (flight_date_str == date_str)
-    merged = flights_sel.merge(
-        weather_unique,
-        left_on=["origin","flight_date_str"],
-        right_on=["iata","date_str"],
-        how="left",
-        suffixes=("","_weather")
-    )
-
-    # Count how many flights matched weather
-    weather_cols = [c for c in merged.columns if c not in flights_sel.columns]  # newly added cols
-    # Determine rows with at least one weather value (non-null in any added weather column)
-    if weather_cols:
-        has_weather = merged[weather_cols].notna().any(axis=1)
-        n_matched = int(has_weather.sum())
-    else:
-        n_matched = 0
+    # Count how many flights matched weather: the left join leaves every weather
+    # column null together, and 'iata' (weather side) is never null on a match
+    has_weather = merged[weather_col("iata")].notna().to_numpy()
+    n_matched = int(has_weather.sum())
 
     print(f"Voos com weather associado: {n_matched} / {len(merged)}")
 
     # Save merged and missing matches (flights without weather)
-    merged.to_csv(OUT_MERGED, index=False)
-    merged.loc[~merged.index.isin(merged[has_weather].index)].to_csv(OUT_MISSING_MATCHES, index=False)
-    # counts by origin
-    flights_sel["origin"].value_counts().rename_axis("origin").reset_index(name="n_flights").to_csv(OUT_COUNTS, index=False)
+    merged.to_csv(OUT_MERGED, index=False, chunksize=CSV_CHUNKSIZE, lineterminator="\n")
+    merged.loc[~has_weather].to_csv(OUT_MISSING_MATCHES, index=False, chunksize=CSV_CHUNKSIZE, lineterminator="\n")
+    # counts by origin: one bincount over the categorical codes (most flights first)
+    counts = np.bincount(flights_sel["origin"].cat.codes.to_numpy(), minlength=len(SELECTED))
+    counts_df = pd.DataFrame({"origin": SELECTED, "n_flights": counts})
+    counts_df.sort_values("n_flights", ascending=False, kind="stable").to_csv(OUT_COUNTS, index=False)
 
     print("Arquivos gerados:")
     print(" - merged:", OUT_MERGED)
@@ -170,7 +262,7 @@ def main():
     if no_weather.empty:
         print("Todas as linhas casaram com weather (ou não há colunas de weather).")
     else:
-        print(no_weather[["flight_date","origin","flight_date_str","iata","date_str"]].to_string(index=False))
+        print(no_weather[["flight_date","origin","flight_date_str",weather_col("iata"),weather_col("date_str")]].to_string(index=False))
 
 if __name__ == "__main__":
     main()
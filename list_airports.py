@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 """
-Listar arquivos weather_*.csv, extrair metadados e sugerir seleção diversa.
+Listar arquivos weather_*.csv / weather_*.parquet, extrair metadados e sugerir seleção diversa.
 Corrigido para evitar erro de f-string (aspas internas).
-Dependências: pandas
+Dependências: pandas, pyarrow
 """
 
 import os
 import glob
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from collections import defaultdict
+from itertools import zip_longest
 
 # --- configurações ---
 WEATHER_DIR = "./weather_outputs"   # ajuste para a pasta onde estão os CSVs
 PATTERN = os.path.join(WEATHER_DIR, "weather_*.csv")
+PARQUET_PATTERN = os.path.join(WEATHER_DIR, "weather_*.parquet")
 SAMPLE_N = 12                    # default de aeroportos a sugerir (mude se desejar)
 
 # possíveis nomes de colunas de tempo / lat / lon (case-insensitive)
@@ -28,27 +32,23 @@ def find_column(cols, candidates):
             return mapping[cand]
     return None
 
-def assign_region(lat, lon):
+def assign_regions(lats, lons):
     """
-    Heurística simples para regiões dos EUA baseada em lon/lat.
-    Se lat/lon for None -> 'unknown'
+    Heurística simples para regiões dos EUA baseada em lon/lat, vetorizada
+    sobre todos os arquivos de uma vez.
+    Se lat/lon for None/NaN -> 'unknown'
     Regiões: Northeast, Southeast, Midwest, Mountain, West
     """
-    if lat is None or lon is None:
-        return "unknown"
-    # lon esperado negativo para EUA continental
-    try:
-        lat = float(lat)
-        lon = float(lon)
-    except Exception:
-        return "unknown"
-    if lon > -90:
-        return "Northeast" if lat >= 36 else "Southeast"
-    if -105 < lon <= -90:
-        return "Midwest"
-    if -115 < lon <= -105:
-        return "Mountain"
-    return "West"
+    lat = np.asarray(lats, dtype="f8")
+    lon = np.asarray(lons, dtype="f8")
+    # lon esperado negativo para EUA continental; a primeira condição verdadeira vence
+    regions = np.select(
+        [(lon > -90) & (lat >= 36), lon > -90, lon > -105, lon > -115],
+        ["Northeast", "Southeast", "Midwest", "Mountain"],
+        default="West",
+    ).astype(object)
+    regions[np.isnan(lat) | np.isnan(lon)] = "unknown"
+    return regions.tolist()
 
 def human_size(n):
     for unit in ['B','KB','MB','GB']:
@@ -57,15 +57,59 @@ def human_size(n):
         n /= 1024.0
     return f"{n:.1f}TB"
 
-def summarize_weather_files(pattern=PATTERN, max_preview_rows=1000):
-    files = sorted(glob.glob(pattern))
+def count_csv_rows(fp):
+    """Conta linhas de dados (sem header) em blocos binários, sem decodificar linha a linha."""
+    n = 0
+    last = b""
+    with open(fp, "rb") as f:
+        for buf in iter(lambda: f.read(1 << 20), b""):
+            n += buf.count(b"\n")
+            last = buf
+    # última linha sem quebra de linha no fim também conta
+    if last and not last.endswith(b"\n"):
+        n += 1
+    return n - 1
+
+def parquet_column_range(meta, col_idx):
+    """Min/max de uma coluna a partir das estatísticas dos row groups (só o footer)."""
+    mins, maxs = [], []
+    for i in range(meta.num_row_groups):
+        stats = meta.row_group(i).column(col_idx).statistics
+        if stats is not None and stats.has_min_max:
+            mins.append(stats.min)
+            maxs.append(stats.max)
+    if not mins:
+        return None, None
+    return min(mins), max(maxs)
+
+def summarize_parquet_file(fp):
+    """Metadados de um weather_*.parquet lendo apenas o footer (sem varrer os dados)."""
+    pf = pq.ParquetFile(fp)
+    meta = pf.metadata
+    names = pf.schema_arrow.names
+    time_col = find_column(names, TIME_COLS)
+    lat_col = find_column(names, LAT_COLS)
+    lon_col = find_column(names, LON_COLS)
+    min_time = max_time = lat = lon = None
+    if time_col:
+        min_time, max_time = parquet_column_range(meta, names.index(time_col))
+    if lat_col and lon_col:
+        lat = parquet_column_range(meta, names.index(lat_col))[0]
+        lon = parquet_column_range(meta, names.index(lon_col))[0]
+        lat = float(lat) if lat is not None else None
+        lon = float(lon) if lon is not None else None
+    return meta.num_rows, min_time, max_time, lat, lon
+
+def summarize_weather_files(pattern=PATTERN, max_preview_rows=1000, parquet_pattern=PARQUET_PATTERN):
+    files = sorted(glob.glob(pattern) + glob.glob(parquet_pattern))
     summary = []
     for fp in files:
         fname = os.path.basename(fp)
-        # extrai IATA assumindo padrão weather_IATA.csv
+        stem, ext = os.path.splitext(fname)
+        # extrai IATA assumindo padrão weather_IATA.csv / weather_IATA.parquet
         iata = None
-        if fname.lower().startswith("weather_") and fname.lower().endswith(".csv"):
-            iata = fname[len("weather_"):-4].upper()
+        if stem.lower().startswith("weather_"):
+            iata = stem[len("weather_"):].upper()
         size_bytes = os.path.getsize(fp)
         n_rows = None
         min_time = None
@@ -74,44 +118,52 @@ def summarize_weather_files(pattern=PATTERN, max_preview_rows=1000):
         lon = None
         error = None
 
-        try:
-            # lê só as primeiras linhas para inspecionar colunas rapidamente
-            df = pd.read_csv(fp, nrows=max_preview_rows)
-            # conta linhas mais precisamente (substitui tentativa anterior)
+        if ext.lower() == ".parquet":
+            try:
+                n_rows, min_time, max_time, lat, lon = summarize_parquet_file(fp)
+            except Exception as e:
+                error = str(e)
+        else:
             try:
-                with open(fp, 'r', encoding='utf-8', errors='ignore') as f:
-                    n_rows = sum(1 for _ in f) - 1  # menos header
-            except Exception:
-                n_rows = None
-
-            time_col = find_column(df.columns, TIME_COLS)
-            lat_col = find_column(df.columns, LAT_COLS)
-            lon_col = find_column(df.columns, LON_COLS)
-
-            if time_col:
-                try:
-                    times = pd.to_datetime(df[time_col], errors="coerce")
-                    if not times.dropna().empty:
-                        min_time = times.min()
-                        max_time = times.max()
-                except Exception:
-                    min_time = None
-                    max_time = None
-
-            # tenta obter lat/lon a partir das colunas se existirem
-            if lat_col and lon_col:
-                lat_vals = pd.to_numeric(df[lat_col], errors="coerce")
-                lon_vals = pd.to_numeric(df[lon_col], errors="coerce")
-                if not lat_vals.dropna().empty and not lon_vals.dropna().empty:
-                    lat = float(lat_vals.dropna().iloc[0])
-                    lon = float(lon_vals.dropna().iloc[0])
-
-            # se não houver lat/lon, às vezes o IATA está na própria tabela (como no exemplo enviado)
-            # e podemos deixar lat/lon = None (não crítico).
-        except Exception as e:
-            error = str(e)
-
-        region = assign_region(lat, lon)
+                # lê só as primeiras linhas para inspecionar colunas rapidamente
+                df = pd.read_csv(fp, nrows=max_preview_rows)
+                # se a prévia cobriu o arquivo todo, já temos a contagem exata;
+                # senão conta quebras de linha em blocos binários
+                if len(df) < max_preview_rows:
+                    n_rows = len(df)
+                else:
+                    try:
+                        n_rows = count_csv_rows(fp)
+                    except Exception:
+                        n_rows = None
+
+                time_col = find_column(df.columns, TIME_COLS)
+                lat_col = find_column(df.columns, LAT_COLS)
+                lon_col = find_column(df.columns, LON_COLS)
+
+                if time_col:
+                    try:
+                        times = pd.to_datetime(df[time_col], errors="coerce")
+                        if not times.dropna().empty:
+                            min_time = times.min()
+                            max_time = times.max()
+                    except Exception:
+                        min_time = None
+                        max_time = None
+
+                # tenta obter lat/lon a partir das colunas se existirem
+                if lat_col and lon_col:
+                    lat_vals = pd.to_numeric(df[lat_col], errors="coerce")
+                    lon_vals = pd.to_numeric(df[lon_col], errors="coerce")
+                    if not lat_vals.dropna().empty and not lon_vals.dropna().empty:
+                        lat = float(lat_vals.dropna().iloc[0])
+                        lon = float(lon_vals.dropna().iloc[0])
+
+                # se não houver lat/lon, às vezes o IATA está na própria tabela (como no exemplo enviado)
+                # e podemos deixar lat/lon = None (não crítico).
+            except Exception as e:
+                error = str(e)
+
         summary.append({
             "iata": iata,
             "file": fp,
@@ -121,9 +173,12 @@ def summarize_weather_files(pattern=PATTERN, max_preview_rows=1000):
             "max_time": str(max_time) if max_time is not None else None,
             "lat": lat,
             "lon": lon,
-            "region": region,
+            "region": None,  # preenchido abaixo para todos os arquivos de uma vez
             "error": error
         })
+    regions = assign_regions([s["lat"] for s in summary], [s["lon"] for s in summary])
+    for s, region in zip(summary, regions):
+        s["region"] = region
     return summary
 
 def suggest_diverse_selection(summary, n=SAMPLE_N):
@@ -145,30 +200,14 @@ def suggest_diverse_selection(summary, n=SAMPLE_N):
         regions[r].sort(key=lambda x: (x.get("n_rows") or 0), reverse=True)
     unknown.sort(key=lambda x: (x.get("n_rows") or 0), reverse=True)
 
-    selected = []
+    # rodada idx = o idx-ésimo maior arquivo de cada região (regiões em ordem alfabética);
+    # o round-robin esgota todas as regiões, então o que sobra para completar
+    # são só os 'unknown' (já ordenados), sem precisar checar duplicatas
     region_list = sorted(regions.keys())
-    idx = 0
-    while len(selected) < n and any(len(v) > idx for v in regions.values()):
-        for r in region_list:
-            if len(selected) >= n:
-                break
-            if len(regions[r]) > idx:
-                selected.append(regions[r][idx])
-        idx += 1
-
-    if len(selected) < n:
-        remaining = []
-        for r in region_list:
-            remaining += regions[r][idx:]
-        remaining += unknown
-        remaining.sort(key=lambda x: (x.get("n_rows") or 0), reverse=True)
-        for it in remaining:
-            if len(selected) >= n:
-                break
-            if it not in selected:
-                selected.append(it)
-
-    return selected
+    rounds = zip_longest(*(regions[r] for r in region_list))
+    order = [it for rnd in rounds for it in rnd if it is not None]
+    order += unknown
+    return order[:n]
 
 def print_summary(summary):
     if not summary:
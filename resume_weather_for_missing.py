@@ -1,8 +1,11 @@
 # resume_weather_for_missing.py
-import requests, certifi, time, csv
+import requests, certifi, time, csv, atexit
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 OUT_DIR = Path("weather_outputs")
 OUT_DIR.mkdir(exist_ok=True)
@@ -15,9 +18,10 @@ DAILY_VARS = "weather_code,temperature_2m_max,temperature_2m_min,precipitation_s
 
 REQUEST_TIMEOUT = 30
 SLEEP_BETWEEN_REQUESTS = 4.0   # mais conservador
-SLEEP_ON_429 = 60             # aguarda 60s se 429
-RETRY_ATTEMPTS = 6
+RETRY_ATTEMPTS = 6             # 429/5xx: backoff exponencial, respeitando Retry-After
+MAX_CONCURRENT_REQUESTS = 4   # meses baixados em paralelo por aeroporto
 USE_MONTHLY = True
+INT16_VARS = ["weather_code", "wind_direction_10m_dominant"]  # códigos WMO / graus 0-360
 START_DATE = date(2024,1,1)
 END_DATE = date(2024,12,31)
 
@@ -54,90 +58,98 @@ if not MISSING.exists():
 with open(MISSING) as f:
     miss = [l.strip().upper() for l in f if l.strip()]
 
-# prepare log
-if not LOG.exists():
-    with open(LOG, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["iata","status","notes"])
+# prepare log: um único handle (line-buffered) aberto durante todo o resume
+new_log = not LOG.exists()
+log_fh = open(LOG, "a", newline="", buffering=1)
+atexit.register(log_fh.close)
+log_writer = csv.writer(log_fh)
+if new_log:
+    log_writer.writerow(["iata","status","notes"])
 
-def safe_get(params):
+# uma única sessão (keep-alive): o handshake TCP/TLS é feito uma vez por conexão
+# do pool, não a cada mês; os retries (429/5xx e falhas de conexão) ficam no urllib3
+SESSION = requests.Session()
+SESSION.verify = certifi.where()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=MAX_CONCURRENT_REQUESTS,
+    pool_maxsize=MAX_CONCURRENT_REQUESTS,
+    max_retries=Retry(total=RETRY_ATTEMPTS, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+def fetch_month(iata, lat, lon, sdate, edate):
+    # baixa um período (mês) de um aeroporto; retorna DataFrame ou None se falhar
+    params = {
+        "latitude": float(lat),
+        "longitude": float(lon),
+        "start_date": sdate.isoformat(),
+        "end_date": edate.isoformat(),
+        "daily": DAILY_VARS,
+        "timezone": "UTC"
+    }
     try:
-        r = requests.get(OPEN_METEO_ARCHIVE, params=params, timeout=REQUEST_TIMEOUT, verify=certifi.where())
+        r = SESSION.get(OPEN_METEO_ARCHIVE, params=params, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
-        return r
-    except requests.exceptions.HTTPError as e:
-        if e.response is not None and e.response.status_code == 429:
-            raise requests.exceptions.RetryError("429")
-        raise
+        j = r.json()
+    except Exception as e:
+        print(f"[{iata}] esgotou tentativas para o mês {sdate}:", type(e).__name__, e)
+        return None
+    if "daily" not in j or "time" not in j["daily"]:
+        print(f"[{iata}] resposta sem daily no mês {sdate} -> {list(j.keys())}")
+        return None
+    # dict de listas -> todas as colunas construídas de uma vez
+    dfw = pd.DataFrame(j["daily"])
+    dfw["iata"] = iata
+    time.sleep(SLEEP_BETWEEN_REQUESTS)
+    return dfw
 
-for iata in miss:
-    print("===== PROCESSANDO", iata, "=====")
-    if iata not in ap.index:
-        print("Sem coords para", iata, "- registrando e pulando")
-        with open(LOG, "a", newline="") as f:
-            csv.writer(f).writerow([iata, "no_coords", "pulado"])
-        continue
+# os meses de cada aeroporto são baixados em paralelo (no máximo
+# MAX_CONCURRENT_REQUESTS requisições em voo, cada worker ainda dorme
+# SLEEP_BETWEEN_REQUESTS entre chamadas para não estourar o rate limit)
+with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as ex:
+    for iata in miss:
+        print("===== PROCESSANDO", iata, "=====")
+        if iata not in ap.index:
+            print("Sem coords para", iata, "- registrando e pulando")
+            log_writer.writerow([iata, "no_coords", "pulado"])
+            continue
 
-    outfn = OUT_DIR / f"weather_{iata}.csv"
-    if outfn.exists():
-        print("Cache já existe (talvez foi baixado por outro batch). Pulando.")
-        with open(LOG, "a", newline="") as f:
-            csv.writer(f).writerow([iata, "cached", "ok"])
-        continue
+        outfn = OUT_DIR / f"weather_{iata}.parquet"
+        if outfn.exists() or outfn.with_suffix(".csv").exists():
+            print("Cache já existe (talvez foi baixado por outro batch). Pulando.")
+            log_writer.writerow([iata, "cached", "ok"])
+            continue
 
-    lat = ap.loc[iata, "lat"]
-    lon = ap.loc[iata, "lon"]
-    months = months_between(START_DATE, END_DATE) if USE_MONTHLY else [(START_DATE, END_DATE)]
-    parts = []
-    failed = False
-    for (sdate, edate) in months:
-        params = {
-            "latitude": float(lat),
-            "longitude": float(lon),
-            "start_date": sdate.isoformat(),
-            "end_date": edate.isoformat(),
-            "daily": DAILY_VARS,
-            "timezone": "UTC"
-        }
-        backoff = 1
-        for attempt in range(1, RETRY_ATTEMPTS+1):
-            try:
-                r = safe_get(params)
-                j = r.json()
-                if "daily" not in j or "time" not in j["daily"]:
-                    print(f"[{iata}] resposta sem daily no mês {sdate} -> {list(j.keys())}")
-                    failed = True
-                    break
-                dfw = pd.DataFrame({"time": j["daily"]["time"]})
-                for var in j["daily"]:
-                    if var == "time": continue
-                    dfw[var] = j["daily"][var]
-                dfw["iata"] = iata
-                parts.append(dfw)
-                time.sleep(SLEEP_BETWEEN_REQUESTS)
+        lat = ap.loc[iata, "lat"]
+        lon = ap.loc[iata, "lon"]
+        months = months_between(START_DATE, END_DATE) if USE_MONTHLY else [(START_DATE, END_DATE)]
+        futures = {ex.submit(fetch_month, iata, lat, lon, *m): i for i, m in enumerate(months)}
+        parts = [None] * len(months)  # na ordem original dos meses
+        for fut in as_completed(futures):
+            dfw = fut.result()
+            if dfw is None:
+                # como antes: o primeiro mês perdido encerra o aeroporto; meses ainda
+                # não iniciados são cancelados (não gastam tentativas durante um 429)
+                print(f"[{iata}] mês perdido -> pulando aeroporto")
+                for f in futures:
+                    f.cancel()
                 break
-            except requests.exceptions.RetryError:
-                print(f"[{iata}] 429 recebido. Tentativa {attempt}/{RETRY_ATTEMPTS}. Dormindo {SLEEP_ON_429 + backoff}s.")
-                time.sleep(SLEEP_ON_429 + backoff)
-                backoff *= 2
-            except Exception as e:
-                print(f"[{iata}] Erro (attempt {attempt}):", type(e).__name__, e)
-                time.sleep(2 + attempt)
-        else:
-            print(f"[{iata}] esgotou tentativas para o mês {sdate} -> pulando aeroporto")
-            failed = True
-            break
+            parts[futures[fut]] = dfw
+        failed = any(p is None for p in parts)
 
-    if parts and not failed:
-        df_all = pd.concat(parts, ignore_index=True)
-        df_all["time"] = pd.to_datetime(df_all["time"])
-        df_all.to_csv(outfn, index=False)
-        print(f"[{iata}] salvo cache ({len(df_all)} linhas).")
-        with open(LOG, "a", newline="") as f:
-            csv.writer(f).writerow([iata, "ok", "salvo"])
-    else:
-        print(f"[{iata}] falhou no download completo.")
-        with open(LOG, "a", newline="") as f:
-            csv.writer(f).writerow([iata, "failed", "partial_or_429"])
+        if parts and not failed:
+            df_all = pd.concat(parts, ignore_index=True)
+            df_all["time"] = pd.to_datetime(df_all["time"])
+            # códigos/direções cabem em int16 (nullable: meses sem dado chegam como NaN);
+            # grandezas físicas ficam em float64 (float32 gera ruído como 3.0999999 no CSV
+            # final; o zstd do parquet já cuida do tamanho)
+            for c in INT16_VARS:
+                if c in df_all.columns:
+                    df_all[c] = df_all[c].astype("Int16")
+            df_all.to_parquet(outfn, index=False, compression="zstd")
+            print(f"[{iata}] salvo cache ({len(df_all)} linhas).")
+            log_writer.writerow([iata, "ok", "salvo"])
+        else:
+            print(f"[{iata}] falhou no download completo.")
+            log_writer.writerow([iata, "failed", "partial_or_429"])
 
 print("Fim do resume. Veja", LOG)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+weather_to_parquet.py
+
+Migração única: lê selected_weather/weather_<IATA>.csv (ou .parquet, como gravado
+por resume_weather_for_missing.py) e grava um dataset Parquet
+particionado por IATA (weather/iata=BOS/..., zstd), lido por flights_weather_2024.py
+com filtro de IATA e projeção de colunas sem reparsear CSV a cada execução.
+Também grava weather_indexed.parquet: a tabela já deduplicada, indexada por
+(iata, data) e ordenada, que flights_weather_2024.py usa direto no join.
+Dependências: pyarrow
+"""
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from flights_weather_2024 import (
+    SELECTED, WEATHER_DIR, WEATHER_PARQUET_DIR, WEATHER_INDEXED,
+    index_weather, read_weather_dataset, read_weather_file, weather_file_for,
+)
+
+def load_for_dataset(p):
+    # mesmo leitor do fallback de flights_weather_2024.py (datas, iata, source_file);
+    # date_str é recalculada por read_weather_dataset, então não vai para o dataset
+    t = read_weather_file(p, p.stem[len("weather_"):].upper())
+    if t is None:
+        print("Sem coluna de data, ignorado:", p.name)
+        return None
+    return t.drop_columns(["date_str"])
+
+def main():
+    # um arquivo por IATA, com a mesma preferência do pipeline (.parquet antes de .csv)
+    iatas = sorted({p.stem[len("weather_"):] for p in WEATHER_DIR.glob("weather_*.*") if p.suffix in (".csv", ".parquet")})
+    files = [weather_file_for(WEATHER_DIR, iata) for iata in iatas]
+    if not files:
+        print("Nenhum weather_*.csv / weather_*.parquet encontrado em", WEATHER_DIR)
+        return
+    # promote_options="permissive" unifica colunas totalmente vazias (tipo null) e
+    # tipos numéricos diferentes entre arquivos (ex.: int16 dos .parquet vs int64 do CSV)
+    tables = [t for t in map(load_for_dataset, files) if t is not None]
+    if not tables:
+        return
+    table = pa.concat_tables(tables, promote_options="permissive")
+    pq.write_to_dataset(
+        table,
+        root_path=WEATHER_PARQUET_DIR,
+        partition_cols=["iata"],
+        compression="zstd",
+        existing_data_behavior="delete_matching",
+    )
+    print(f"{len(files)} arquivos ({table.num_rows} linhas) gravados em {WEATHER_PARQUET_DIR}")
+
+    weather_all, _ = read_weather_dataset(SELECTED, WEATHER_PARQUET_DIR)
+    index_weather(weather_all).to_parquet(WEATHER_INDEXED, compression="zstd")
+    print("Tabela pronta para o join gravada em", WEATHER_INDEXED)
+
+if __name__ == "__main__":
+    main()